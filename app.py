@@ -2,35 +2,31 @@
 import os
 
 # For consistency with TypeScript code, `cdk` is the preferred import name for
-# the CDK's core module.  The following line also imports it as `core` for use
-# with examples from the CDK Developer's Guide, which are in the process of
-# being updated to use `cdk`.  You may delete this import if you don't need it.
-from aws_cdk import core
+# the CDK's core module.
 from aws_cdk import core as cdk
 
 # from eks_platform.eks_platform_stack import EksPlatformStack
 from deployment import Platform
 from pipeline import Pipeline
 
-dev_env = cdk.Environment(
-    account=os.environ["CDK_DEFAULT_ACCOUNT"],
-    region=os.environ["CDK_DEFAULT_REGION"]
-)
+account = os.environ["CDK_DEFAULT_ACCOUNT"]
+region = os.environ["CDK_DEFAULT_REGION"]
 
-pipeline_env = cdk.Environment(
-    account=os.environ["CDK_DEFAULT_ACCOUNT"],
-    region=os.environ["CDK_DEFAULT_REGION"]
+# The dev platform and the pipeline are deployed to the same account and region
+env = cdk.Environment(account=account, region=region)
 
-)
-app = core.App()
+# Collecting a stack trace for every construct slows down synth, set CDK_DEV_TRACES=1
+# to keep them in the cloud assembly metadata while debugging locally
+stack_traces = os.environ.get("CDK_DEV_TRACES", "").lower() in ("1", "true", "yes")
+app = cdk.App(stack_traces=stack_traces)
 
 Platform(app,
          f"{Platform.__name__}-Dev",
-         env=dev_env,
+         env=env,
          env_name="dev",
          cluster_name="eks-test"
          )
 
-Pipeline(app, f"{Platform.__name__}-Pipeline", env=pipeline_env)
+Pipeline(app, f"{Platform.__name__}-Pipeline", env=env)
 
 app.synth()
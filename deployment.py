@@ -2,6 +2,7 @@ from typing import Any
 
 from aws_cdk import core as cdk
 
+from eks.eks import FLAGS_NAMES
 from eks.eks import PlatformEKS
 from network.infra import PlatformNetwork
 
@@ -22,20 +23,24 @@ class Platform(cdk.Stage):
     ):
         super().__init__(scope, id_, env=env, outdir=outdir)
 
-        platform_network_stack = cdk.Stack(self, "Network")
+        # Network and EKS share a single stack so the VPC is an in-stack reference
+        # instead of a cross-stack export/import
+        platform_stack = cdk.Stack(self, "Platform")
         network = PlatformNetwork(
-            platform_network_stack,
+            platform_stack,
             "PlatformNetwork")
 
         cluster_name = "eks"
         if "cluster_name" in kwargs:
             cluster_name = kwargs.get("cluster_name")
 
-        platform_eks_stack = cdk.Stack(self, "EKS")
-        PlatformEKS(scope=platform_eks_stack,
+        # Only the flags that are set are passed, PlatformEKS holds the defaults
+        flags = {flag: kwargs[flag] for flag in FLAGS_NAMES if flag in kwargs}
+        PlatformEKS(scope=platform_stack,
                     id="PlatformEKS",
                     vpc=network.vpc,
                     env=env,
                     env_name=env_name,
-                    cluster_name=cluster_name
+                    cluster_name=cluster_name,
+                    **flags
                     )
@@ -1,6 +1,8 @@
-from typing import cast
+import functools
+import json
+import os
+from typing import Any, NamedTuple, Tuple
 
-import requests
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_eks as eks
 from aws_cdk import aws_iam as iam
@@ -9,16 +11,252 @@ from aws_cdk import core as cdk
 # Flags const
 DEPLOY_CLUSTER_AUTOSCALER = "deploy_cluster_autoscaler"
 DEPLOY_AWS_LB_CONTROLLER = "deploy_alb_controller"
+REFRESH_AWS_LB_CONTROLLER_POLICY = "refresh_alb_controller_policy"
+
+FLAGS_NAMES = (
+    DEPLOY_CLUSTER_AUTOSCALER,
+    DEPLOY_AWS_LB_CONTROLLER,
+    REFRESH_AWS_LB_CONTROLLER_POLICY
+)
+
+# Flags not listed here default to True
+FLAGS_DEFAULTS = {
+    REFRESH_AWS_LB_CONTROLLER_POLICY: False
+}
 
 # Params const list
 CLUSTER_NAME = "cluster_name"
 ENV = "env_name"
 
+PARAMS_NAMES = (
+    CLUSTER_NAME,
+    ENV
+)
+
+# Cluster Autoscaler
+CLUSTER_AUTOSCALER = "cluster-autoscaler"
+
+# Helm values that do not depend on the cluster, merged with the per-cluster ones
+_CA_VALUES_STATIC = {
+    "resources": {
+        "requests": {
+            "cpu": "1",
+            "memory": "512Mi",
+        },
+        "limits": {
+            "cpu": "1",
+            "memory": "512Mi",
+        }
+    },
+    "rbac": {
+        "serviceAccount": {
+            "create": False,
+            "name": CLUSTER_AUTOSCALER
+        }
+    },
+    "extraArgs": {
+        "expander": "priority",
+        "max-node-provision-time": "5m0s"
+    },
+    "replicaCount": 1
+}
+
 # AWS LB Controller
 AWS_LB_CONTROLLER = "aws-load-balancer-controller"
 
+_LBC_VALUES_STATIC = {
+    "serviceAccount": {
+        "create": False,
+        "name": AWS_LB_CONTROLLER
+    },
+    "replicaCount": 2
+}
+
+# IAM policy of the controller release matching the helm chart version "1.2.3"
+AWS_LB_CONTROLLER_IAM_POLICY_URL = "https://raw.githubusercontent.com/kubernetes-sigs/aws-load-balancer-controller/v2.2.0/docs/install/iam_policy.json"
+AWS_LB_CONTROLLER_IAM_POLICY_PATH = os.path.join(os.path.dirname(__file__), "assets/aws_lb_controller_iam_policy_v2_2_0.json")
+
+
+# Nodegroups
+class NGSpec(NamedTuple):
+    id: str
+    role_id: str
+    name: str
+    capacity_type: eks.CapacityType
+    ami_type: eks.NodegroupAmiType
+    instance_types: Tuple[str, ...]
+    desired_size: int
+
+
+NG_SPECS = (
+    # On Demand subnets nodegroup
+    NGSpec(id="ODDefaultNodegroup",
+           role_id="ODDefaultNGRole",
+           name="od-default-ng",
+           capacity_type=eks.CapacityType.ON_DEMAND,
+           ami_type=eks.NodegroupAmiType.AL2_X86_64,
+           instance_types=("m5.large",),
+           desired_size=1),
+    # Spot subnets nodegroup
+    NGSpec(id="SpotDefaultNodegroup",
+           role_id="SPOTDefaultNGRole",
+           name="spot-default-ng",
+           capacity_type=eks.CapacityType.SPOT,
+           ami_type=eks.NodegroupAmiType.AL2_X86_64,
+           instance_types=("m5.large", "c5.large", "m4.large", "c4.large"),
+           desired_size=1),
+    # Graviton subnets nodegroup
+    NGSpec(id="ODGravitonNodegroup",
+           role_id="ODGravitonNGRole",
+           name="od-graviton-ng",
+           capacity_type=eks.CapacityType.SPOT,
+           ami_type=eks.NodegroupAmiType.AL2_ARM_64,
+           instance_types=("m6g.large",),
+           desired_size=0),
+)
+
+NG_MANAGED_POLICY_NAMES = (
+    "AmazonSSMManagedInstanceCore",
+    "AmazonEKSWorkerNodePolicy",
+    "AmazonEKS_CNI_Policy",
+    "AmazonEC2ContainerRegistryReadOnly",
+)
+
+# IAM policy statements
+_CLUSTER_ADMIN_POLICY = {
+    "Effect": "Allow",
+    "Action": [
+        "eks:DescribeCluster"
+    ],
+    "Resource": "*"
+}
+
+_CA_POLICY = {
+    "Effect": "Allow",
+    "Action": [
+        "autoscaling:DescribeAutoScalingGroups",
+        "autoscaling:DescribeAutoScalingInstances",
+        "autoscaling:DescribeLaunchConfigurations",
+        "autoscaling:DescribeTags",
+        "autoscaling:SetDesiredCapacity",
+        "autoscaling:TerminateInstanceInAutoScalingGroup",
+        "ec2:DescribeLaunchTemplateVersions"
+    ],
+    "Resource": "*"
+}
+
+# GitHub secrets read by the bastion for the Flux bootstrap
+_BASTION_SECRETS_POLICY = {
+    "Effect": "Allow",
+    "Action": "secretsmanager:GetSecretValue",
+    "Resource": [
+        "arn:aws:secretsmanager:eu-west-1:*:secret:github-token*",
+        "arn:aws:secretsmanager:eu-west-1:*:secret:github-user*"
+    ],
+}
+
+# SSM Agent installer DaemonSet
+_SSM_AGENT_MANIFEST = {
+    "apiVersion": "apps/v1",
+    "kind": "DaemonSet",
+    "metadata": {
+        "labels": {
+            "k8s-app": "ssm-installer"
+        },
+        "name": "ssm-installer",
+        "namespace": "kube-system"
+    },
+    "spec": {
+        "selector": {
+            "matchLabels": {
+                "k8s-app": "ssm-installer"
+            }
+        },
+        "template": {
+            "metadata": {
+                "labels": {
+                    "k8s-app": "ssm-installer"
+                }
+            },
+            "spec": {
+                "containers": [
+                    {
+                        "image": "amazonlinux",
+                        "imagePullPolicy": "Always",
+                        "name": "ssm",
+                        "command": [
+                            "/bin/bash"
+                        ],
+                        "args": [
+                            "-c",
+                            "echo '* * * * * root yum install -y https://s3.amazonaws.com/ec2-downloads-windows/SSMAgent/latest/linux_amd64/amazon-ssm-agent.rpm & rm -rf /etc/cron.d/ssmstart' > /etc/cron.d/ssmstart"
+                        ],
+                        "securityContext": {
+                            "allowPrivilegeEscalation": True
+                        },
+                        "volumeMounts": [
+                            {
+                                "mountPath": "/etc/cron.d",
+                                "name": "cronfile"
+                            }
+                        ],
+                        "terminationMessagePath": "/dev/termination-log",
+                        "terminationMessagePolicy": "File"
+                    }
+                ],
+                "volumes": [
+                    {
+                        "name": "cronfile",
+                        "hostPath": {
+                            "path": "/etc/cron.d",
+                            "type": "Directory"
+                        }
+                    }
+                ],
+                "dnsPolicy": "ClusterFirst",
+                "restartPolicy": "Always",
+                "schedulerName": "default-scheduler",
+                "terminationGracePeriodSeconds": 30
+            }
+        }
+    }
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _managed(name: str) -> iam.IManagedPolicy:
+    # AWS managed policy references are immutable, so one instance is shared per name
+    return iam.ManagedPolicy.from_aws_managed_policy_name(managed_policy_name=name)
+
+
+@functools.lru_cache(maxsize=None)
+def _http_session() -> Any:
+    # requests is only needed when refreshing remote assets, keep it off the import path
+    import requests  # pylint: disable=import-outside-toplevel
+    return requests.Session()
+
+
+@functools.lru_cache(maxsize=4)
+def _fetch_json(url: str) -> dict:
+    resp = _http_session().get(url, timeout=(3, 10))
+    resp.raise_for_status()
+    return resp.json()
+
 
 class PlatformEKS(cdk.Construct):
+    # cdk.Construct keeps its own __dict__, the slots cover the attributes added here
+    __slots__ = (
+        "flags",
+        "params",
+        "env",
+        "eks_vpc",
+        "_ec2_trust",
+        "eks_cluster",
+        "cluster_admin_role",
+        "bastion",
+        "ssm_agent_manifest",
+    )
+
     def __init__(
             self,
             scope: cdk.Construct,
@@ -29,69 +267,40 @@ class PlatformEKS(cdk.Construct):
             **kwargs):
         super().__init__(scope, id)
 
-        self.flags_names = [
-            DEPLOY_CLUSTER_AUTOSCALER,
-            DEPLOY_AWS_LB_CONTROLLER
-        ]
-
-        self.params_names = [
-            CLUSTER_NAME,
-            ENV
-        ]
-
         # extract flags from kwargs
         self.flags = self._extract_flags_from_kwargs(**kwargs)
         self.params = self._extract_params_from_kwargs(**kwargs)
 
         self.env = env
         self.eks_vpc = vpc
+        # Trust policy shared by the cluster admin and node group roles
+        self._ec2_trust = iam.CompositePrincipal(
+            iam.AccountRootPrincipal(),
+            iam.ServicePrincipal("ec2.amazonaws.com")
+        )
         self.eks_cluster = self._create_eks()
         self._create_nodegroups()
         self._deploy_addons()
 
     def _extract_params_from_kwargs(self, **kwargs: dict) -> dict:
-        parameters = dict()
-        for param in self.params_names:
-            parameters[param] = param
-            if param in kwargs:
-                parameters[param] = kwargs.get(param)
-
-        return parameters
+        return {param: kwargs.get(param, param) for param in PARAMS_NAMES}
 
     def _extract_flags_from_kwargs(self, **kwargs: dict) -> dict:
-        flags = dict()
-        for flag in self.flags_names:
-            flags[flag] = True  # default all flags to True
-            if flag in kwargs:
-                flags[flag] = kwargs.get(flag)
-        return flags
+        return {flag: kwargs.get(flag, FLAGS_DEFAULTS.get(flag, True)) for flag in FLAGS_NAMES}
 
     def _create_eks(self, **kwargs) -> eks.Cluster:
 
         # Create IAM Role For EC2 bastion instance to be able to manage the cluster
         self.cluster_admin_role = iam.Role(self, "ClusterAdminRole",
-                                           assumed_by=cast(
-                                               iam.IPrincipal,
-                                               iam.CompositePrincipal(
-                                                   iam.AccountRootPrincipal(),
-                                                   iam.ServicePrincipal("ec2.amazonaws.com")
-                                               )
-                                           )
+                                           assumed_by=self._ec2_trust
                                            )
-        cluster_admin_policy_statement_json_1 = {
-            "Effect": "Allow",
-            "Action": [
-                "eks:DescribeCluster"
-            ],
-            "Resource": "*"
-        }
-        self.cluster_admin_role.add_to_policy(iam.PolicyStatement.from_json(cluster_admin_policy_statement_json_1))
+        self.cluster_admin_role.add_to_policy(iam.PolicyStatement.from_json(_CLUSTER_ADMIN_POLICY))
 
         # Create SecurityGroup for the Control Plane ENIs
         eks_security_group = ec2.SecurityGroup(
             self,
             "EKSSecurityGroup",
-            vpc=cast(ec2.IVpc, self.eks_vpc),
+            vpc=self.eks_vpc,
             allow_all_outbound=True,
         )
 
@@ -104,14 +313,14 @@ class PlatformEKS(cdk.Construct):
         eks_cluster = eks.Cluster(
             self,
             "cluster",
-            cluster_name=self.params[CLUSTER_NAME] + "-" + self.params[ENV],
-            vpc=cast(ec2.IVpc, self.eks_vpc),
+            cluster_name=f"{self.params[CLUSTER_NAME]}-{self.params[ENV]}",
+            vpc=self.eks_vpc,
             # Use /28 subnets for the Control plane cross account ENIs
             # as recommended in https://docs.aws.amazon.com/eks/latest/userguide/network_reqs.html
             vpc_subnets=[ec2.SubnetSelection(subnet_group_name="eks-control-plane")],
-            masters_role=cast(iam.IRole, self.cluster_admin_role),
+            masters_role=self.cluster_admin_role,
             default_capacity=0,
-            security_group=cast(ec2.ISecurityGroup, eks_security_group),
+            security_group=eks_security_group,
             endpoint_access=eks.EndpointAccess.PRIVATE,
             version=eks.KubernetesVersion.V1_20,
         )
@@ -120,89 +329,26 @@ class PlatformEKS(cdk.Construct):
 
     def _create_nodegroups(self) -> None:
 
-        required_nodegroup_managed_policy = [
-            iam.ManagedPolicy.from_aws_managed_policy_name(
-                managed_policy_name="AmazonSSMManagedInstanceCore"),
-            iam.ManagedPolicy.from_aws_managed_policy_name(
-                managed_policy_name="AmazonEKSWorkerNodePolicy"),
-            iam.ManagedPolicy.from_aws_managed_policy_name(
-                managed_policy_name="AmazonEKS_CNI_Policy"),
-            iam.ManagedPolicy.from_aws_managed_policy_name(
-                managed_policy_name="AmazonEC2ContainerRegistryReadOnly"),
-        ]
-        # Create IAM Role For node groups
-        od_default_ng_role = iam.Role(self, "ODDefaultNGRole",
-                                      assumed_by=cast(iam.IPrincipal, iam.CompositePrincipal(iam.AccountRootPrincipal(),
-                                                                                             iam.ServicePrincipal(
-                                                                                                 "ec2.amazonaws.com")
-                                                                                             )),
-                                      managed_policies=required_nodegroup_managed_policy,
-                                      )
-        spot_default_ng_role = iam.Role(self, "SPOTDefaultNGRole",
-                                        assumed_by=cast(iam.IPrincipal,
-                                                        iam.CompositePrincipal(iam.AccountRootPrincipal(),
-                                                                               iam.ServicePrincipal(
-                                                                                   "ec2.amazonaws.com")
-                                                                               )),
-                                        managed_policies=required_nodegroup_managed_policy,
-                                        )
-        od_graviton_ng_role = iam.Role(self, "ODGravitonNGRole",
-                                       assumed_by=cast(iam.IPrincipal,
-                                                       iam.CompositePrincipal(iam.AccountRootPrincipal(),
-                                                                              iam.ServicePrincipal(
-                                                                                  "ec2.amazonaws.com")
-                                                                              )),
-                                       managed_policies=required_nodegroup_managed_policy,
-                                       )
-
-        # On Demand subnets nodegroup
-        self.eks_cluster.add_nodegroup_capacity(
-            "ODDefaultNodegroup",
-            nodegroup_name="od-default-ng",
-            capacity_type=eks.CapacityType.ON_DEMAND,
-            min_size=0,
-            desired_size=1,
-            max_size=10,
-            ami_type=eks.NodegroupAmiType.AL2_X86_64,
-            instance_types=[
-                ec2.InstanceType("m5.large"),
-            ],
-            node_role=od_default_ng_role,
-            subnets=ec2.SubnetSelection(subnet_group_name="Private")
-        )
-        # Spot subnets nodegroup
-        self.eks_cluster.add_nodegroup_capacity(
-            "SpotDefaultNodegroup",
-            nodegroup_name="spot-default-ng",
-            capacity_type=eks.CapacityType.SPOT,
-            min_size=0,
-            desired_size=1,
-            max_size=10,
-            ami_type=eks.NodegroupAmiType.AL2_X86_64,
-            instance_types=[
-                ec2.InstanceType("m5.large"),
-                ec2.InstanceType("c5.large"),
-                ec2.InstanceType("m4.large"),
-                ec2.InstanceType("c4.large"),
-            ],
-            node_role=spot_default_ng_role,
-            subnets=ec2.SubnetSelection(subnet_group_name="Private")
-        )
-        # Graviton subnets nodegroup
-        self.eks_cluster.add_nodegroup_capacity(
-            "ODGravitonNodegroup",
-            nodegroup_name="od-graviton-ng",
-            capacity_type=eks.CapacityType.SPOT,
-            min_size=0,
-            desired_size=0,
-            max_size=10,
-            ami_type=eks.NodegroupAmiType.AL2_ARM_64,
-            instance_types=[
-                ec2.InstanceType("m6g.large"),
-            ],
-            node_role=od_graviton_ng_role,
-            subnets=ec2.SubnetSelection(subnet_group_name="Private")
-        )
+        required_nodegroup_managed_policy = [_managed(name) for name in NG_MANAGED_POLICY_NAMES]
+
+        for spec in NG_SPECS:
+            # Create IAM Role For node groups
+            node_role = iam.Role(self, spec.role_id,
+                                 assumed_by=self._ec2_trust,
+                                 managed_policies=required_nodegroup_managed_policy,
+                                 )
+            self.eks_cluster.add_nodegroup_capacity(
+                spec.id,
+                nodegroup_name=spec.name,
+                capacity_type=spec.capacity_type,
+                min_size=0,
+                desired_size=spec.desired_size,
+                max_size=10,
+                ami_type=spec.ami_type,
+                instance_types=[ec2.InstanceType(instance_type) for instance_type in spec.instance_types],
+                node_role=node_role,
+                subnets=ec2.SubnetSelection(subnet_group_name="Private")
+            )
 
         # TODO: add nodegroups for GPU
         return
@@ -228,35 +374,20 @@ class PlatformEKS(cdk.Construct):
             self._deploy_cluster_autoscaler()
 
         if self.flags[DEPLOY_AWS_LB_CONTROLLER] is True:
-            self._deploy_aws_load_balancer_controller()
+            self._deploy_aws_load_balancer_controller(
+                refresh=self.flags[REFRESH_AWS_LB_CONTROLLER_POLICY]
+            )
 
         return
 
     def _deploy_cluster_autoscaler(self) -> None:
-        ca_sa_name = "cluster-autoscaler"
         cluster_autoscaler_service_account = self.eks_cluster.add_service_account(
             "cluster_autoscaler",
-            name=ca_sa_name,
+            name=CLUSTER_AUTOSCALER,
             namespace="kube-system"
         )
-        # Create the PolicyStatements to attach to the role
-        cluster_autoscaler_policy_statement = {
-            "Effect": "Allow",
-            "Action": [
-                "autoscaling:DescribeAutoScalingGroups",
-                "autoscaling:DescribeAutoScalingInstances",
-                "autoscaling:DescribeLaunchConfigurations",
-                "autoscaling:DescribeTags",
-                "autoscaling:SetDesiredCapacity",
-                "autoscaling:TerminateInstanceInAutoScalingGroup",
-                "ec2:DescribeLaunchTemplateVersions"
-            ],
-            "Resource": "*"
-        }
-
         # Attach the necessary permissions
-        cluster_autoscaler_service_account.add_to_policy(
-            iam.PolicyStatement.from_json(cluster_autoscaler_policy_statement))
+        cluster_autoscaler_service_account.add_to_policy(iam.PolicyStatement.from_json(_CA_POLICY))
         # Set CA for priority expander
         self.eks_cluster.add_manifest(
             "CAPriorityExpanderConfigMap",
@@ -286,44 +417,33 @@ class PlatformEKS(cdk.Construct):
                     "clusterName": self.eks_cluster.cluster_name
                 },
                 "awsRegion": self.env.region,
-                "resources": {
-                    "requests": {
-                        "cpu": "1",
-                        "memory": "512Mi",
-                    },
-                    "limits": {
-                        "cpu": "1",
-                        "memory": "512Mi",
-                    }
-                },
-                "rbac": {
-                    "serviceAccount": {
-                        "create": False,
-                        "name": ca_sa_name
-                    }
-                },
-                "extraArgs": {
-                    "expander": "priority",
-                    "max-node-provision-time": "5m0s"
-                },
-                "replicaCount": 1
+                **_CA_VALUES_STATIC
             }
         )
         cluster_autoscaler_chart.node.add_dependency(self.ssm_agent_manifest)
         return
 
-    def _deploy_aws_load_balancer_controller(self):
+    def _deploy_aws_load_balancer_controller(self, refresh: bool = False):
         aws_lb_controller_service_account = self.eks_cluster.add_service_account(
             "aws-load-balancer-controller",
             name=AWS_LB_CONTROLLER,
             namespace="kube-system"
         )
-        resp = requests.get(
-            "https://raw.githubusercontent.com/kubernetes-sigs/aws-load-balancer-controller/v2.2.0/docs/install/iam_policy.json")
-        aws_load_balancer_controller_policy = resp.json()
-
-        for stmt in aws_load_balancer_controller_policy["Statement"]:
-            aws_lb_controller_service_account.add_to_principal_policy(iam.PolicyStatement.from_json(stmt))
+        # The policy is bundled with the repo so synth stays local and deterministic,
+        # set the refresh_alb_controller_policy flag to fetch it from upstream instead
+        if refresh:
+            aws_load_balancer_controller_policy = _fetch_json(AWS_LB_CONTROLLER_IAM_POLICY_URL)
+        else:
+            with open(AWS_LB_CONTROLLER_IAM_POLICY_PATH) as policy_file:
+                aws_load_balancer_controller_policy = json.load(policy_file)
+
+        # Attach all the statements as a single policy on the service account role
+        aws_lb_controller_policy = iam.Policy(
+            self, "AwsLbControllerPolicy",
+            statements=[iam.PolicyStatement.from_json(stmt)
+                        for stmt in aws_load_balancer_controller_policy["Statement"]],
+            roles=[aws_lb_controller_service_account.role]
+        )
 
         # Deploy the AWS Load Balancer Controller from the AWS Helm Chart
         # For more info check out https://github.com/aws/eks-charts/tree/master/stable/aws-load-balancer-controller
@@ -338,14 +458,11 @@ class PlatformEKS(cdk.Construct):
                 "clusterName": self.eks_cluster.cluster_name,
                 "region": self.env.region,
                 "vpcId": self.eks_vpc.vpc_id,
-                "serviceAccount": {
-                    "create": False,
-                    "name": AWS_LB_CONTROLLER
-                },
-                "replicaCount": 2
+                **_LBC_VALUES_STATIC
             }
         )
         aws_lb_controller_chart.node.add_dependency(aws_lb_controller_service_account)
+        aws_lb_controller_chart.node.add_dependency(aws_lb_controller_policy)
         return
 
     def _deploy_bastion(self):
@@ -358,21 +475,10 @@ class PlatformEKS(cdk.Construct):
         cluster_admin_role_instance_profile.node.add_dependency(self.cluster_admin_role)
 
         # Another way into our Bastion is via Systems Manager Session Manager
-        self.cluster_admin_role.add_managed_policy(
-            iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSSMManagedInstanceCore"))
+        self.cluster_admin_role.add_managed_policy(_managed("AmazonSSMManagedInstanceCore"))
 
         # policy to retrieve GitHub secrets from secretsmanager for Flux boostrap command
-        bastion_secrets_manager_policy = {
-            "Effect": "Allow",
-            "Action": "secretsmanager:GetSecretValue",
-            "Resource": [
-                "arn:aws:secretsmanager:eu-west-1:*:secret:github-token*",
-                "arn:aws:secretsmanager:eu-west-1:*:secret:github-user*"
-            ],
-
-        }
-
-        self.cluster_admin_role.add_to_policy(iam.PolicyStatement.from_json(bastion_secrets_manager_policy))
+        self.cluster_admin_role.add_to_policy(iam.PolicyStatement.from_json(_BASTION_SECRETS_POLICY))
 
         # Create code-server bastion
         # Get Latest Amazon Linux AMI
@@ -401,6 +507,8 @@ class PlatformEKS(cdk.Construct):
         )
 
         # Create our Bastion EC2 instance running CodeServer
+        region = self.env.region
+        cluster_name = self.eks_cluster.cluster_name
 
         self.bastion = ec2.Instance(
             self, "EKSBastion",
@@ -408,66 +516,54 @@ class PlatformEKS(cdk.Construct):
             machine_image=amazon_linux_2,
             role=self.cluster_admin_role,
             vpc=self.eks_vpc,
-            instance_name=self.eks_cluster.cluster_name + "-bastion",
+            instance_name=f"{cluster_name}-bastion",
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
             security_group=bastion_security_group,
             block_devices=[ec2.BlockDevice(device_name="/dev/xvda", volume=ec2.BlockDeviceVolume.ebs(20))]
         )
 
         # Add UserData
-        self.bastion.user_data.add_commands("yum -y install perl-Digest-SHA")
-        self.bastion.user_data.add_commands("mkdir -p ~/.local/lib ~/.local/bin ~/.config/code-server")
-        self.bastion.user_data.add_commands(
-            "curl -fL https://github.com/cdr/code-server/releases/download/v3.9.1/code-server-3.9.1-linux-amd64.tar.gz | tar -C ~/.local/lib -xz")
-        self.bastion.user_data.add_commands(
-            "mv ~/.local/lib/code-server-3.9.1-linux-amd64 ~/.local/lib/code-server-3.9.1")
-        self.bastion.user_data.add_commands(
-            "ln -s ~/.local/lib/code-server-3.9.1/bin/code-server ~/.local/bin/code-server")
-        self.bastion.user_data.add_commands(
-            "echo \"bind-addr: 0.0.0.0:8080\" > ~/.config/code-server/config.yaml")
-        self.bastion.user_data.add_commands("echo \"auth: password\" >> ~/.config/code-server/config.yaml")
-        self.bastion.user_data.add_commands(
-            "echo \"password: $(curl -s http://169.254.169.254/latest/meta-data/instance-id)\" >> ~/.config/code-server/config.yaml")
-        self.bastion.user_data.add_commands("echo \"cert: false\" >> ~/.config/code-server/config.yaml")
-        self.bastion.user_data.add_commands("~/.local/bin/code-server &")
-        self.bastion.user_data.add_commands(
-            "echo \"/root/.local/bin/code-server &\" >> /etc/rc.d/rc.local")
-        self.bastion.user_data.add_commands("chmod a+x /etc/rc.d/rc.local")
-        self.bastion.user_data.add_commands(
-            "curl -o kubectl https://amazon-eks.s3.us-west-2.amazonaws.com/1.19.6/2021-01-05/bin/linux/amd64/kubectl")
-        self.bastion.user_data.add_commands("chmod +x ./kubectl")
-        self.bastion.user_data.add_commands("mv ./kubectl /usr/bin")
-        self.bastion.user_data.add_commands("curl https://intoli.com/install-google-chrome.sh | bash")
-        self.bastion.user_data.add_commands(
-            "~/.local/bin/code-server --install-extension auchenberg.vscode-browser-preview")
-        self.bastion.user_data.add_commands(
-            "aws eks update-kubeconfig --name " + self.eks_cluster.cluster_name + " --region " + self.env.region)
-
-        self.bastion.user_data.add_commands("PATH=$PATH:/usr/local/bin")
-        self.bastion.user_data.add_commands("export KUBECONFIG=~/.kube/config")
-        self.bastion.user_data.add_commands("curl -s https://fluxcd.io/install.sh | sudo bash")
-        self.bastion.user_data.add_commands("echo 'PATH=$PATH:/usr/local/bin' >> ~/.bash_profile")
-        self.bastion.user_data.add_commands("echo '. <(flux completion bash)' >> ~/.bash_profile")
-
-        # bootstrap flux using the bastion user-data
-
-        self.bastion.user_data.add_commands(
-            "export GITHUB_TOKEN=$(aws --region {region} secretsmanager get-secret-value --secret-id github-token --query 'SecretString' --output text)".format(
-                region=self.env.region))
-        self.bastion.user_data.add_commands(
-            "export GITHUB_USER=$(aws --region {region} secretsmanager get-secret-value --secret-id github-user --query 'SecretString' --output text)".format(
-                region=self.env.region))
-        self.bastion.user_data.add_commands("KUBECONFIG=~/.kube/config flux bootstrap github \
+        bastion_commands = [
+            "yum -y install perl-Digest-SHA",
+            "mkdir -p ~/.local/lib ~/.local/bin ~/.config/code-server",
+            "curl -fL https://github.com/cdr/code-server/releases/download/v3.9.1/code-server-3.9.1-linux-amd64.tar.gz | tar -C ~/.local/lib -xz",
+            "mv ~/.local/lib/code-server-3.9.1-linux-amd64 ~/.local/lib/code-server-3.9.1",
+            "ln -s ~/.local/lib/code-server-3.9.1/bin/code-server ~/.local/bin/code-server",
+            "echo \"bind-addr: 0.0.0.0:8080\" > ~/.config/code-server/config.yaml",
+            "echo \"auth: password\" >> ~/.config/code-server/config.yaml",
+            "echo \"password: $(curl -s http://169.254.169.254/latest/meta-data/instance-id)\" >> ~/.config/code-server/config.yaml",
+            "echo \"cert: false\" >> ~/.config/code-server/config.yaml",
+            "~/.local/bin/code-server &",
+            "echo \"/root/.local/bin/code-server &\" >> /etc/rc.d/rc.local",
+            "chmod a+x /etc/rc.d/rc.local",
+            "curl -o kubectl https://amazon-eks.s3.us-west-2.amazonaws.com/1.19.6/2021-01-05/bin/linux/amd64/kubectl",
+            "chmod +x ./kubectl",
+            "mv ./kubectl /usr/bin",
+            "curl https://intoli.com/install-google-chrome.sh | bash",
+            "~/.local/bin/code-server --install-extension auchenberg.vscode-browser-preview",
+            f"aws eks update-kubeconfig --name {cluster_name} --region {region}",
+
+            "PATH=$PATH:/usr/local/bin",
+            "export KUBECONFIG=~/.kube/config",
+            "curl -s https://fluxcd.io/install.sh | sudo bash",
+            "echo 'PATH=$PATH:/usr/local/bin' >> ~/.bash_profile",
+            "echo '. <(flux completion bash)' >> ~/.bash_profile",
+
+            # bootstrap flux using the bastion user-data
+            f"export GITHUB_TOKEN=$(aws --region {region} secretsmanager get-secret-value --secret-id github-token --query 'SecretString' --output text)",
+            f"export GITHUB_USER=$(aws --region {region} secretsmanager get-secret-value --secret-id github-user --query 'SecretString' --output text)",
+            f"KUBECONFIG=~/.kube/config flux bootstrap github \
                                                       --owner=$GITHUB_USER \
                                                       --repository=flux-system-eks \
                                                       --path=clusters/{cluster_name} \
-                                                      --personal".format(cluster_name=self.eks_cluster.cluster_name)
-                                            )
+                                                      --personal",
+        ]
+        self.bastion.user_data.add_commands(*bastion_commands)
 
         # Output the Bastion address
         cdk.CfnOutput(
             self, "BastionAddress",
-            value="http://" + self.bastion.instance_public_ip + ":8080",
+            value=f"http://{self.bastion.instance_public_ip}:8080",
             description="Address to reach your Bastion's VS Code Web UI",
         )
         # Wait to deploy Bastion until cluster is up and we're deploying manifests/charts to it
@@ -479,70 +575,4 @@ class PlatformEKS(cdk.Construct):
     def _deploy_ssm_agent(self):
         # For more information see
         # https://docs.aws.amazon.com/prescriptive-guidance/latest/patterns/install-ssm-agent-on-amazon-eks-worker-nodes-by-using-kubernetes-daemonset.html
-        self.ssm_agent_manifest = \
-            self.eks_cluster.add_manifest("SSMAgentManifest",
-                                          {
-                                              "apiVersion": "apps/v1",
-                                              "kind": "DaemonSet",
-                                              "metadata": {
-                                                  "labels": {
-                                                      "k8s-app": "ssm-installer"
-                                                  },
-                                                  "name": "ssm-installer",
-                                                  "namespace": "kube-system"
-                                              },
-                                              "spec": {
-                                                  "selector": {
-                                                      "matchLabels": {
-                                                          "k8s-app": "ssm-installer"
-                                                      }
-                                                  },
-                                                  "template": {
-                                                      "metadata": {
-                                                          "labels": {
-                                                              "k8s-app": "ssm-installer"
-                                                          }
-                                                      },
-                                                      "spec": {
-                                                          "containers": [
-                                                              {
-                                                                  "image": "amazonlinux",
-                                                                  "imagePullPolicy": "Always",
-                                                                  "name": "ssm",
-                                                                  "command": [
-                                                                      "/bin/bash"
-                                                                  ],
-                                                                  "args": [
-                                                                      "-c",
-                                                                      "echo '* * * * * root yum install -y https://s3.amazonaws.com/ec2-downloads-windows/SSMAgent/latest/linux_amd64/amazon-ssm-agent.rpm & rm -rf /etc/cron.d/ssmstart' > /etc/cron.d/ssmstart"
-                                                                  ],
-                                                                  "securityContext": {
-                                                                      "allowPrivilegeEscalation": True
-                                                                  },
-                                                                  "volumeMounts": [
-                                                                      {
-                                                                          "mountPath": "/etc/cron.d",
-                                                                          "name": "cronfile"
-                                                                      }
-                                                                  ],
-                                                                  "terminationMessagePath": "/dev/termination-log",
-                                                                  "terminationMessagePolicy": "File"
-                                                              }
-                                                          ],
-                                                          "volumes": [
-                                                              {
-                                                                  "name": "cronfile",
-                                                                  "hostPath": {
-                                                                      "path": "/etc/cron.d",
-                                                                      "type": "Directory"
-                                                                  }
-                                                              }
-                                                          ],
-                                                          "dnsPolicy": "ClusterFirst",
-                                                          "restartPolicy": "Always",
-                                                          "schedulerName": "default-scheduler",
-                                                          "terminationGracePeriodSeconds": 30
-                                                      }
-                                                  }
-                                              }
-                                          })
+        self.ssm_agent_manifest = self.eks_cluster.add_manifest("SSMAgentManifest", _SSM_AGENT_MANIFEST)
@@ -1,17 +1,77 @@
+import functools
+import hashlib
 import json
 import os
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional
 
 # import boto3
-from aws_cdk import aws_codepipeline as codepipeline
-from aws_cdk import aws_codepipeline_actions as codepipeline_actions
 from aws_cdk import core as cdk
-from aws_cdk import pipelines
 from aws_cdk.core import SecretValue
 
 from deployment import Platform
 
+if TYPE_CHECKING:
+    from aws_cdk import aws_codepipeline as codepipeline
+    from aws_cdk import aws_codepipeline_actions as codepipeline_actions
+    from aws_cdk import pipelines
+
+try:
+    import orjson as json_parser
+except ImportError:  # orjson is optional, the stdlib parser reads bytes as well
+    json_parser = json  # type: ignore
+
+# Read at import so a missing variable fails before any construct is created
+_CDK_ACCOUNT = os.environ["CDK_DEFAULT_ACCOUNT"]
+_CDK_DEFAULT_REGION = os.environ["CDK_DEFAULT_REGION"]
+# The repository owner is public, prefer it as a plain string over a secret lookup
+_GITHUB_OWNER = os.environ.get("GITHUB_OWNER")
+
+_PRE_PROD_ID = f"{Platform.__name__}-PreProd"
+_PROD_ID = f"{Platform.__name__}-Prod"
+
+
+class StageSpec(NamedTuple):
+    name: str
+    stage_id: str
+    # Value of the "stage" context that selects this stage
+    selector: str
+    # Platform env_name, the Platform default is used when None
+    env_name: Optional[str]
+    region: str
+    # Context key of the manual approval after the stage is deployed, setting it to
+    # false skips the approval. Stages without a key have no approval.
+    approval_context: Optional[str]
+
+
+# Pipeline stages in deployment order
+_STAGES = (
+    StageSpec(name="PreProd",
+              stage_id=_PRE_PROD_ID,
+              selector="pre-prod",
+              env_name="pre-prod",
+              region=_CDK_DEFAULT_REGION,
+              approval_context="require_preprod_approval"),
+    StageSpec(name="Prod",
+              stage_id=_PROD_ID,
+              selector="prod",
+              env_name=None,
+              region="eu-central-1",
+              approval_context=None),
+)
+
+_PACKAGE_JSON_PATH = Path(__file__).resolve().parent / "package.json"
+# Dev dependency holding the CDK CLI version the pipeline installs
+_CDK_CLI_PACKAGE = "aws-cdk"
+
+
+@functools.lru_cache(maxsize=1)
+def _load_cdk_cli_version() -> str:
+    # package.json does not change during a synth, read it once per process
+    package_json = json_parser.loads(_PACKAGE_JSON_PATH.read_bytes())
+    cdk_cli_version: str = package_json["devDependencies"][_CDK_CLI_PACKAGE]
+    return cdk_cli_version
+
 
 class Pipeline(cdk.Stack):
     # pylint: disable=redefined-builtin
@@ -19,6 +79,12 @@ class Pipeline(cdk.Stack):
     def __init__(self, scope: cdk.Construct, id: str, **kwargs: Any):
         super().__init__(scope, id, **kwargs)
 
+        # The pipeline modules are only loaded when a Pipeline stack is created
+        # pylint: disable=import-outside-toplevel
+        from aws_cdk import aws_codepipeline as codepipeline
+        from aws_cdk import aws_codepipeline_actions as codepipeline_actions
+        from aws_cdk import pipelines
+
         source_artifact = codepipeline.Artifact()
         cloud_assembly_artifact = codepipeline.Artifact()
 
@@ -27,19 +93,16 @@ class Pipeline(cdk.Stack):
             output=source_artifact,
             # pylint: disable=line-too-long
             oauth_token=SecretValue.secrets_manager('github-token'),
-            owner=SecretValue.secrets_manager('github-user').to_string(),
+            owner=_GITHUB_OWNER or SecretValue.secrets_manager('github-user').to_string(),
             repo="eks-platform",
             branch="main",
+            # Start on GitHub push events instead of polling the repository
+            trigger=codepipeline_actions.GitHubTrigger.WEBHOOK,
         )
 
-        synth_action = pipelines.SimpleSynthAction(
-            source_artifact=source_artifact,
-            cloud_assembly_artifact=cloud_assembly_artifact,
-            install_commands=[
-                "pyenv local 3.7.10",
-                "./scripts/install-deps.sh",
-            ],
-            synth_command="npx cdk synth",
+        synth_action = self._create_synth_action(
+            source_artifact,
+            cloud_assembly_artifact
         )
 
         cdk_pipeline = pipelines.CdkPipeline(
@@ -47,48 +110,143 @@ class Pipeline(cdk.Stack):
             "EKSPlatform",
             source_action=source_action,
             synth_action=synth_action,  # type: ignore
-            single_publisher_per_type=True,
-            cdk_cli_version=Pipeline._get_cdk_cli_version(),
+            # One publish action per asset, they share a run order and run in parallel
+            single_publisher_per_type=False,
+            cdk_cli_version=self._cdk_cli_version,
             cloud_assembly_artifact=cloud_assembly_artifact,
         )
 
-        self._add_pre_prod_stage(cdk_pipeline)
-        self._add_prod_stage(cdk_pipeline)
-
-    @staticmethod
-    def _get_cdk_cli_version() -> str:
-        package_json_path = Path(__file__).resolve().parent.joinpath("package.json")
-        with open(package_json_path) as package_json_file:
-            package_json = json.load(package_json_file)
-        cdk_cli_version = str(package_json["devDependencies"]["aws-cdk"])
-        return cdk_cli_version
-
-    def _add_pre_prod_stage(self, cdk_pipeline: pipelines.CdkPipeline) -> None:
-        pre_prod_env = cdk.Environment(
-            account=os.environ["CDK_DEFAULT_ACCOUNT"],
-            region=os.environ["CDK_DEFAULT_REGION"]
+        self._add_selected_stages(cdk_pipeline)
+
+    def _create_synth_action(
+            self,
+            source_artifact: "codepipeline.Artifact",
+            cloud_assembly_artifact: "codepipeline.Artifact"
+    ) -> "codepipeline_actions.CodeBuildAction":
+        # pylint: disable=import-outside-toplevel
+        from aws_cdk import aws_codebuild as codebuild
+        from aws_cdk import aws_codepipeline_actions as codepipeline_actions
+
+        build_environment = codebuild.BuildEnvironment(
+            build_image=codebuild.LinuxBuildImage.STANDARD_5_0
         )
+        # Keep the owner when the pipeline synthesizes itself
+        environment_variables = {
+            "GITHUB_OWNER": codebuild.BuildEnvironmentVariable(value=_GITHUB_OWNER)
+        } if _GITHUB_OWNER else {}
+        build_spec = codebuild.BuildSpec.from_object({
+            "version": "0.2",
+            "phases": {
+                "pre_build": {
+                    "commands": [
+                        "pyenv local 3.7.10",
+                        "./scripts/install-deps.sh",
+                    ]
+                },
+                "build": {
+                    "commands": [
+                        "npx cdk synth",
+                    ]
+                }
+            },
+            "artifacts": {
+                "base-directory": "cdk.out",
+                "files": "**/*"
+            },
+            "cache": {
+                "paths": [
+                    "/root/.cache/pip/**/*",
+                    "node_modules/**/*",
+                ]
+            }
+        })
 
-        pre_prod_platform_stage = Platform(
+        # A plain CodeBuild project instead of SimpleSynthAction, which can't configure
+        # a build cache, so dependency installs are reused between synth runs
+        synth_project = codebuild.PipelineProject(
             self,
-            f"{Platform.__name__}-PreProd",
-            env=pre_prod_env,
-            env_name="pre-prod"
+            "SynthProject",
+            environment=build_environment,
+            cache=codebuild.Cache.local(codebuild.LocalCacheMode.CUSTOM),
+            environment_variables=environment_variables or None,
+            build_spec=build_spec,
         )
-        pre_prod_stage = cdk_pipeline.add_application_stage(pre_prod_platform_stage)
-        pre_prod_stage.add_manual_approval_action(
-            action_name="ConfirmPreProdDeployment",
-            run_order=pre_prod_stage.next_sequential_run_order()
+
+        # Same as SimpleSynthAction: a hash of the project config on the action makes
+        # any buildspec change a pipeline structure change, so self-mutation restarts
+        # the run with the new project instead of using the old cloud assembly
+        project_config = self.resolve({
+            "environment": {
+                "type": build_environment.build_image.type,
+                "imageId": build_environment.build_image.image_id,
+            },
+            "buildSpecString": build_spec.to_build_spec(),
+            "environmentVariables": {
+                name: variable.value for name, variable in environment_variables.items()
+            },
+        })
+        project_config_hash = hashlib.sha256(
+            json.dumps(project_config, sort_keys=True).encode()
+        ).hexdigest()
+
+        return codepipeline_actions.CodeBuildAction(
+            action_name="Synth",
+            project=synth_project,
+            input=source_artifact,
+            outputs=[cloud_assembly_artifact],
+            environment_variables={
+                "_PROJECT_CONFIG_HASH": codebuild.BuildEnvironmentVariable(
+                    value=project_config_hash
+                )
+            },
         )
 
-    def _add_prod_stage(self, cdk_pipeline: pipelines.CdkPipeline) -> None:
-        prod_env = cdk.Environment(
-            account=os.environ["CDK_DEFAULT_ACCOUNT"],
-            region="eu-central-1"
+    @property
+    def _cdk_cli_version(self) -> str:
+        # functools.cached_property needs Python 3.8, the synth build runs 3.7
+        return _load_cdk_cli_version()
+
+    def _require_approval(self, stage_spec: StageSpec) -> bool:
+        if stage_spec.approval_context is None:
+            return False
+        # Context values are strings when passed with -c and booleans in cdk.json
+        require_approval = self.node.try_get_context(stage_spec.approval_context)
+        return str(require_approval).lower() != "false"
+
+    def _add_selected_stages(self, cdk_pipeline: "pipelines.CdkPipeline") -> None:
+        # Synthesize a single stage with `-c stage=pre-prod` or `-c stage=prod`
+        stage_filter = self.node.try_get_context("stage")
+        # An unknown value would silently drop every stage from the pipeline
+        stage_filters = {None, "all"} | {stage_spec.selector for stage_spec in _STAGES}
+        if stage_filter not in stage_filters:
+            raise ValueError(f"Unknown stage context value: {stage_filter!r}")
+        for stage_spec in _STAGES:
+            if stage_filter in (None, "all", stage_spec.selector):
+                self._add_stage(cdk_pipeline, stage_spec)
+
+    def _add_stage(
+            self,
+            cdk_pipeline: "pipelines.CdkPipeline",
+            stage_spec: StageSpec
+    ) -> None:
+        env = cdk.Environment(
+            account=_CDK_ACCOUNT,
+            region=stage_spec.region
         )
 
-        prod_platform_stage = Platform(
-            self, f"{Platform.__name__}-Prod", env=prod_env
+        # Stages without an env_name use the Platform default
+        platform_kwargs: Dict[str, str] = {}
+        if stage_spec.env_name:
+            platform_kwargs["env_name"] = stage_spec.env_name
+        platform_stage = Platform(
+            self,
+            stage_spec.stage_id,
+            env=env,
+            **platform_kwargs
         )
-        prod_stage = cdk_pipeline.add_application_stage(prod_platform_stage)
-        _ = prod_stage
+        stage = cdk_pipeline.add_application_stage(platform_stage)
+        if self._require_approval(stage_spec):
+            stage.add_manual_approval_action(
+                action_name=f"Confirm{stage_spec.name}Deployment",
+                run_order=stage.next_sequential_run_order()
+            )